@@ -18,11 +18,15 @@
 
 from pkgmonitor.parser import Parser
 from pkgmonitor.fetcher import Fetcher
+from pkgmonitor.mirror import MirrorHealth
 from pkgmonitor.hash import CacheCheck
 from pkgmonitor.terminalhelper import trm
 from pkgmonitor.cache import Cache
+from pkgmonitor.history import History
+from pkgmonitor.resultcache import ResultCache
 import argparse
 import os
+import sys
 import yaml
 import subprocess
 import shutil
@@ -34,6 +38,8 @@ group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument('-u', '--update', action='store_true', help='Take fetch cache and create package Cache. Checks for hash if fetch cache exists.')
 parser.add_argument('-f', '--fetch', action='store_true', help='Fetch repositories into fetch cache. Does not create package Cache')
 group.add_argument('-r', '--rebuild', action='store_true', help='Remove all existing cache and rebuild it.')
+parser.add_argument('-n', '--name', nargs='+', type=str, help='Only process the specified repositories')
+parser.add_argument('-w', '--wait', action='store_true', help='Wait for repositories locked by another process instead of skipping them')
 parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
 args = parser.parse_args()
 
@@ -43,6 +49,15 @@ config.read('./pkgmonitor.conf.default')
 package_cache = config.get('global', 'package_cache')
 fetch_cache = config.get('global', 'fetch_cache')
 reposd = config.get('pkgmonitor-update', 'repos.d')
+history_cache = config.get('global', 'history_cache')
+lock_dir = config.get('global', 'lock_dir')
+result_cache_dir = config.get('global', 'result_cache')
+result_cache_size = config.getint('pkgmonitor', 'result_cache_size')
+history_checkpoint = config.getint('pkgmonitor-update', 'history_checkpoint')
+mirror_health = config.get('pkgmonitor-update', 'mirror_health')
+fetch_timeout = config.getfloat('pkgmonitor-update', 'fetch_timeout')
+fetch_retries = config.getint('pkgmonitor-update', 'fetch_retries')
+fetch_backoff = config.getfloat('pkgmonitor-update', 'fetch_backoff')
 
 # Read user specific config file
 if os.path.exists('/etc/pkgmonitor.conf'):
@@ -53,18 +68,58 @@ if os.path.exists('/etc/pkgmonitor.conf'):
         fetch_cache = config.get('global', 'fetch_cache')
     if config.has_option('pkgmonitor-update', 'repos.d'):
         reposd = config.get('pkgmonitor-update', 'repos.d')
+    if config.has_option('global', 'history_cache'):
+        history_cache = config.get('global', 'history_cache')
+    if config.has_option('global', 'lock_dir'):
+        lock_dir = config.get('global', 'lock_dir')
+    if config.has_option('global', 'result_cache'):
+        result_cache_dir = config.get('global', 'result_cache')
+    if config.has_option('pkgmonitor', 'result_cache_size'):
+        result_cache_size = config.getint('pkgmonitor', 'result_cache_size')
+    if config.has_option('pkgmonitor-update', 'history_checkpoint'):
+        history_checkpoint = config.getint('pkgmonitor-update', 'history_checkpoint')
+    if config.has_option('pkgmonitor-update', 'mirror_health'):
+        mirror_health = config.get('pkgmonitor-update', 'mirror_health')
+    if config.has_option('pkgmonitor-update', 'fetch_timeout'):
+        fetch_timeout = config.getfloat('pkgmonitor-update', 'fetch_timeout')
+    if config.has_option('pkgmonitor-update', 'fetch_retries'):
+        fetch_retries = config.getint('pkgmonitor-update', 'fetch_retries')
+    if config.has_option('pkgmonitor-update', 'fetch_backoff'):
+        fetch_backoff = config.getfloat('pkgmonitor-update', 'fetch_backoff')
 
 # Create cache helper for removing cache files, getting file paths etc.
-cache = Cache(fetch_cache, package_cache, args.verbose)
+# Every repository is locked while it is changed, so independent repositories can be updated by parallel processes.
+cache = Cache(fetch_cache, package_cache, args.verbose, lock_dir)
+
+# Every rebuilt package cache is recorded as a new generation in the history.
+history = History(history_cache, history_checkpoint, args.verbose)
+
+# Cached query results of a rebuilt package cache are dropped.
+result_cache = ResultCache(result_cache_dir, result_cache_size, args.verbose)
+
+def selected(repo):
+    """Returns True if the repository is to be processed according to -n/--name
+    """
+    repo_name = repo[repo.rfind('/')+1:]
+    return not args.name or repo_name in args.name
 
 # Delete the download cache if rebuild option is used.
 if args.rebuild:
     if args.verbose:
         print("Removing existing fetch cache")
-    cache.delFetchContent()
+    for repo in cache.getFetchHead():
+        if not selected(repo):
+            continue
+        with cache.lockFetch(repo, args.wait) as lock:
+            if lock.acquired:
+                cache.delFetchRepo(repo)
 
 # Download packages.gz files, if fetch option is used.
+# Mirror latency, throughput and failures are kept between runs to pick the best mirror first.
+# A file that could not be fetched from any mirror makes the script exit with status 1 in the end.
+fetch_failed = False
 if args.fetch:
+    health = MirrorHealth(mirror_health, args.verbose)
     for yaml_file in pathlib.Path(reposd).glob('*'):
         if args.verbose:
             print(str(yaml_file))
@@ -77,45 +132,66 @@ if args.fetch:
             else:
                 for repo in data:
                     name = repo['name']
+                    if not selected(name):
+                        continue
                     if args.verbose:
                         print("Fetching: "+ name)
-                    for dists in repo['repository']:
-                        url = dists['url']
-                        arch = dists['arch']
-                        dist = dists['dist']
-                        if args.verbose:
-                            print("URL: "+url)
-                            print("arch: "+str(arch))
-                            print("dist: "+str(dist))
-                        f = Fetcher(name, dist, url, arch, args.verbose, fetch_cache)
-                        f.get_packages()
+                    with cache.lockFetch(name, args.wait) as lock:
+                        if not lock.acquired:
+                            continue
+                        for dists in repo['repository']:
+                            url = dists['url']
+                            arch = dists['arch']
+                            dist = dists['dist']
+                            if args.verbose:
+                                print("URL: "+str(url))
+                                print("arch: "+str(arch))
+                                print("dist: "+str(dist))
+                            f = Fetcher(name, dist, url, arch, args.verbose, fetch_cache,
+                                        health, fetch_timeout, fetch_retries, fetch_backoff)
+                            if not f.get_packages():
+                                fetch_failed = True
                     if args.verbose:
                         print(trm.sep())
 
 # Update or rebuild package cache
+# The fetch cache is always locked before the package cache of the same repository.
 hash_check_failed = False
 if args.update:
     if args.verbose:
         print("Checking Hashes")
     for repo in cache.getFetchHead():
+        if not selected(repo):
+            continue
         repo_name = repo[repo.rfind('/')+1:]
         if args.verbose:
             print(repo)
-        for f in cache.getFetchContent(repo):
-            c = CacheCheck(f)
-            if c.check_package_gz():
-                if args.verbose:
-                    print("MATCH: "+f)
-            else:
-                if args.verbose:
-                    print("FAIL: "+f)
-                hash_check_failed = True
-        if hash_check_failed:
-            if args.verbose:
-                print("Rebuilding package cache, removing existing cache")
-            cache.delPackageContent(repo_name)
-            p = Parser(repo_name, repo, package_cache, args.verbose)
-            p.parse()
+        with cache.lockFetch(repo, args.wait) as fetch_lock:
+            if not fetch_lock.acquired:
+                continue
+            for f in cache.getFetchContent(repo):
+                c = CacheCheck(f)
+                if c.check_package_gz():
+                    if args.verbose:
+                        print("MATCH: "+f)
+                else:
+                    if args.verbose:
+                        print("FAIL: "+f)
+                    hash_check_failed = True
+            if hash_check_failed:
+                with cache.lockPackages(repo_name, wait=args.wait) as package_lock:
+                    if package_lock.acquired:
+                        if args.verbose:
+                            print("Rebuilding package cache, removing existing cache")
+                        cache.delPackageContent(repo_name)
+                        p = Parser(repo_name, repo, package_cache, args.verbose)
+                        p.parse()
+                        history.record(repo_name, cache.getPackageNames(repo_name))
+                        result_cache.invalidate(repo_name)
+                    else:
+                        # Check the hashes again next time, the package cache was not rebuilt.
+                        for f in cache.getFetchContent(repo):
+                            os.remove(f+".sha256")
         hash_check_failed = False
         if args.verbose:
             print(trm.sep())
@@ -123,20 +199,42 @@ elif args.rebuild:
     if args.verbose:
         print("Removing existing cache")
     for repo in cache.getPackagesHead():
+        if not selected(repo):
+            continue
         repo_name = repo[repo.rfind('/')+1:]
         if args.verbose:
             print(repo_name)
-        cache.delPackageContent(repo)
+        with cache.lockPackages(repo, wait=args.wait) as lock:
+            if lock.acquired:
+                cache.delPackageContent(repo)
         if args.verbose:
             print(trm.sep())
     for repo in cache.getFetchHead():
-        for f in cache.getFetchContent(repo):
-            c = CacheCheck(f)
-            c.check_package_gz()
+        if not selected(repo):
+            continue
         repo_name = repo[repo.rfind('/')+1:]
         if args.verbose:
             print(repo_name)
-        p = Parser(repo_name,repo,package_cache,args.verbose)
-        p.parse()
+        with cache.lockFetch(repo, args.wait) as fetch_lock:
+            if not fetch_lock.acquired:
+                continue
+            with cache.lockPackages(repo_name, wait=args.wait) as package_lock:
+                if not package_lock.acquired:
+                    continue
+                for f in cache.getFetchContent(repo):
+                    c = CacheCheck(f)
+                    c.check_package_gz()
+                # Another process may have parsed the repository since it was removed above.
+                cache.delPackageContent(repo_name)
+                p = Parser(repo_name,repo,package_cache,args.verbose)
+                p.parse()
+                history.record(repo_name, cache.getPackageNames(repo_name))
+                result_cache.invalidate(repo_name)
         if args.verbose:
             print(trm.sep())
+
+if args.verbose:
+    print("Waited {:.3f}s for locks in total".format(cache.lock_wait_time))
+
+if fetch_failed:
+    sys.exit(1)
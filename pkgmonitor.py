@@ -24,11 +24,32 @@ import pathlib
 import re
 import prettytable
 import configparser
+import time
 from prettytable import PrettyTable
 from colorama import Fore, Back, Style
 from pkgmonitor.terminalhelper import trm
+from pkgmonitor.history import History
+from pkgmonitor.cache import Cache
+from pkgmonitor.reader import InputReader
+from pkgmonitor.resultcache import ResultCache
 from collections import OrderedDict
 
+def parse_date(string):
+    """Converts a date given on the command line to unix time
+    A date without a time refers to the end of that day.
+    """
+    for fmt, end_of_day in (('%Y-%m-%d %H:%M:%S', False), ('%Y-%m-%dT%H:%M:%S', False), ('%Y-%m-%d', True)):
+        try:
+            parsed = time.strptime(string, fmt)
+        except ValueError:
+            continue
+        if end_of_day:
+            # One second before the next midnight, days are not always 24 hours long (DST)
+            next_day = (parsed.tm_year, parsed.tm_mon, parsed.tm_mday + 1, 0, 0, 0, 0, 0, -1)
+            return int(time.mktime(next_day)) - 1
+        return int(time.mktime(parsed))
+    raise argparse.ArgumentTypeError("invalid date '"+string+"', use YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS'")
+
 parser = argparse.ArgumentParser(description="Check local build repository cache for existing/missing packages")
 repo_group = parser.add_mutually_exclusive_group(required=True)
 repo_group.add_argument("-a", "--all", help="Check all repos in cache", action="store_true")
@@ -41,6 +62,10 @@ indent_group.add_argument("-t", "--table", help="Output as table.", action="stor
 indent_group.add_argument("-i", "--indent", help="Indented output", action="store_true")
 parser.add_argument("-f", "--file", nargs='+', type=str, help="Read packages from file")
 parser.add_argument("-p", "--packages", nargs='+', type=str, help="Read packages from argument list, divided by space")
+parser.add_argument("--input-format", choices=InputReader.FORMATS, default='plain', help="Format of files and stdin: plain (one package per line, default), dpkg-status (/var/lib/dpkg/status), dpkg-l (output of dpkg -l) or packages (Packages manifest)")
+parser.add_argument("--at", type=parse_date, metavar="DATE", help="Check against the repository state at DATE (YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS') from the history")
+parser.add_argument("--history", type=str, metavar="PACKAGE", help="Output when PACKAGE was added to or removed from the repositories")
+parser.add_argument("--no-cache", help="Do not use the result cache", action="store_true")
 parser.add_argument("-v", "--verbose", help="Verbose output, otherwise only return status.", action="store_true")
 args = parser.parse_args()
 
@@ -49,7 +74,14 @@ config.read('./pkgmonitor.conf.default')
 release_order = config.get('pkgmonitor', 'release_order')
 release_order = release_order.split()
 rules_dir = config.get('pkgmonitor', 'rules.d')
+dedupe_window = config.getint('pkgmonitor', 'dedupe_window')
+batch_size = config.getint('pkgmonitor', 'batch_size')
 package_cache = config.get('global', 'package_cache')
+history_cache = config.get('global', 'history_cache')
+fetch_cache = config.get('global', 'fetch_cache')
+lock_dir = config.get('global', 'lock_dir')
+result_cache_dir = config.get('global', 'result_cache')
+result_cache_size = config.getint('pkgmonitor', 'result_cache_size')
 
 if os.path.exists('/etc/pkgmonitor.conf'):
     config.read('/etc/pkgmonitor.conf')
@@ -58,8 +90,22 @@ if os.path.exists('/etc/pkgmonitor.conf'):
         release_order = release_order.split()
     if config.has_option('pkgmonitor', 'rules.d'):
         rules_dir = config.get('pkgmonitor', 'rules.d')
+    if config.has_option('pkgmonitor', 'dedupe_window'):
+        dedupe_window = config.getint('pkgmonitor', 'dedupe_window')
+    if config.has_option('pkgmonitor', 'batch_size'):
+        batch_size = config.getint('pkgmonitor', 'batch_size')
     if config.has_option('global', 'package_cache'):
         package_cache = config.get('global', 'package_cache')
+    if config.has_option('global', 'history_cache'):
+        history_cache = config.get('global', 'history_cache')
+    if config.has_option('global', 'fetch_cache'):
+        fetch_cache = config.get('global', 'fetch_cache')
+    if config.has_option('global', 'lock_dir'):
+        lock_dir = config.get('global', 'lock_dir')
+    if config.has_option('global', 'result_cache'):
+        result_cache_dir = config.get('global', 'result_cache')
+    if config.has_option('pkgmonitor', 'result_cache_size'):
+        result_cache_size = config.getint('pkgmonitor', 'result_cache_size')
 
 def check(repo, pkg_file, pkg):
     with open(os.path.join(repo, pkg_file), 'r') as f:
@@ -109,7 +155,7 @@ def filter_package(package):
                 else:
                     removed = blacklist_regex(rules[rule_file][repo], package_name)
         if not removed:
-            packages[repo].append(package_name)
+            packages[repo].add(package_name)
         package_name = package
         removed = False
 
@@ -123,17 +169,25 @@ def print_packages(dict, styling, color):
                 color_print(styling+package,color)
 
 # Build list of repos for -a/--all argument.
+# Past repository states and package histories are served from the history instead of the package cache.
+use_history = args.at is not None or args.history is not None
+if use_history:
+    history = History(history_cache, verbose=args.verbose)
+cache = Cache(fetch_cache, package_cache, args.verbose, lock_dir)
 repo_list = []
 if args.all:
-    for repo in os.listdir(package_cache):
-        repo_list.append(repo)
+    if use_history:
+        repo_list = history.getRepos()
+    else:
+        for repo in os.listdir(package_cache):
+            repo_list.append(repo)
 else:
     repo_list = args.repo
 
 # Create list to later add packages for each repo specified.
 packages = {}
 for repo in repo_list:
-    packages[repo] = []
+    packages[repo] = set()
 
 # Order repos in repo_list
 tmp_repo_list = []
@@ -142,6 +196,32 @@ for repo in release_order:
         tmp_repo_list.append(repo)
 repo_list = tmp_repo_list
 
+# Output the availability changes of a single package and exit.
+if args.history:
+    for repo in repo_list:
+        prefix = ""
+        if len(repo_list) > 1:
+            print(repo)
+            if args.indent:
+                prefix = "  "
+        # Hold a shared lock, so pkgmonitor-update.py does not append to the history while it is read.
+        with cache.lockPackages(repo, shared=True):
+            events = history.getEvents(repo, args.history)
+        if not events:
+            print(prefix+args.history+" was never recorded")
+        for timestamp, present in events:
+            date = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+            color = None
+            if present:
+                if args.color:
+                    color = Fore.GREEN
+                color_print(prefix+date+" added", color)
+            else:
+                if args.color:
+                    color = Fore.RED
+                color_print(prefix+date+" removed", color)
+    sys.exit(0)
+
 # Gather all available rule files in list an sort them to adhere to predictability
 rule_files = []
 for f in pathlib.Path(rules_dir).glob('*'):
@@ -160,69 +240,117 @@ for rfile in rule_files:
 rules = OrderedDict(sorted(rules.items()))
 
 # Use file, arguments or stdin for package names, exit with error if none is used.
-no_input = True
-if args.file:
-    no_input = False
-    for pkg_file in args.file:
-        with open(pkg_file, 'r') as f:
-            for line in f.readlines():
-                filter_package(line.rstrip())
-if args.packages:
-    no_input = False
-    for package in args.packages:
-        filter_package(package)
-if not sys.stdin.isatty():
-    no_input = False
-    for line in sys.stdin:
-        filter_package(line.rstrip())
-if no_input:
+# The input is streamed through the reader and handed to the rules in batches, duplicates are dropped on the way.
+def input_packages():
+    if args.file:
+        for pkg_file in args.file:
+            with open(pkg_file, 'r') as f:
+                yield from reader.read(f)
+    if args.packages:
+        yield from args.packages
+    if not sys.stdin.isatty():
+        yield from reader.read(sys.stdin)
+
+if not args.file and not args.packages and sys.stdin.isatty():
     sys.exit("No input was given, you need to use -f/--file, -p/--packages or pipe your input to this script.")
+reader = InputReader(args.input_format, dedupe_window, batch_size)
+for batch in reader.batches(reader.unique(input_packages())):
+    for package in batch:
+        filter_package(package)
 
-# If using table output, save all packages in a list without repo specification
-# Otherwise, remove all redundancies from package list for each repo
-table_packages = []
-if args.table:
+# Answer repeated queries from the result cache. The key covers the package cache generation of every repo,
+# the repo list, the output mode and the package names left by the rules, so any change leads to a new evaluation.
+result_key = None
+result = None
+if not args.no_cache and args.at is None:
+    try:
+        result_cache = ResultCache(result_cache_dir, result_cache_size, args.verbose)
+        fingerprints = []
+        for repo in repo_list:
+            fingerprints.append(cache.getPackagesFingerprint(repo))
+        result_key = result_cache.key(fingerprints, repo_list, args.table, *[packages[repo] for repo in repo_list])
+        result = result_cache.get(result_key)
+    except OSError as e:
+        # Without access to the result cache, the query is evaluated uncached.
+        if args.verbose:
+            print("Result cache unavailable: "+str(e))
+        result_key = None
+        result = None
+
+if result is None:
+    # If using table output, save all packages in a list without repo specification
+    # Otherwise, remove all redundancies from package list for each repo
+    table_packages = []
+    if args.table:
+        for repo in packages:
+            table_packages.extend(packages[repo])
+        table_packages = list(set(table_packages))
+    else:
+        for repo in repo_list:
+            packages[repo] = list(set(packages[repo]))
+
+    # For every repo specified, check the availability of packages given.
+    verdict_dict = {}
+    for repo in repo_list:
+        verdict_dict[repo] = {}
+        verdict_dict[repo]['ok'] = []
+        verdict_dict[repo]['miss'] = []
+        repo_path = os.path.join(package_cache, repo)
+        if args.table:
+            package_list = table_packages
+        else:
+            package_list = packages[repo]
+        if args.at is not None:
+            with cache.lockPackages(repo, shared=True):
+                repo_state = history.getState(repo, args.at)
+            if repo_state is None:
+                sys.exit(repo + " has no recorded history at the given date!")
+            for package in package_list:
+                if package in repo_state:
+                    verdict_dict[repo]['ok'].append(package)
+                else:
+                    verdict_dict[repo]['miss'].append(package)
+            verdict_dict[repo]['ok'].sort()
+            verdict_dict[repo]['miss'].sort()
+        elif os.path.isdir(repo_path):
+            # Hold a shared lock, so pkgmonitor-update.py does not rebuild the package cache while it is read.
+            with cache.lockPackages(repo, shared=True):
+                for package in package_list:
+                    if package.startswith('lib'):
+                        filename = package[0:4]
+                    else:
+                        filename = package[0]
+                    if check(repo_path, filename, package):
+                        verdict_dict[repo]['ok'].append(package)
+                    else:
+                        verdict_dict[repo]['miss'].append(package)
+            verdict_dict[repo]['ok'].sort()
+            verdict_dict[repo]['miss'].sort()
+        else:
+            sys.exit(repo_path + " is not a directory!")
+
+    totals = {}
     for repo in packages:
-        table_packages.extend(packages[repo])
-    table_packages = list(set(table_packages))
+        totals[repo] = len(packages[repo])
+    if result_key is not None:
+        try:
+            result_cache.put(result_key, repo_list, {'totals': totals, 'table_packages': table_packages, 'verdict': verdict_dict})
+        except OSError as e:
+            if args.verbose:
+                print("Result not cached: "+str(e))
 else:
-    for repo in repo_list:
-        packages[repo] = list(set(packages[repo]))
+    totals = result['totals']
+    table_packages = result['table_packages']
+    verdict_dict = result['verdict']
 
 # Some verbose to tell the user, how many packages were given to the script.
 if args.verbose:
-    for repo in packages:
+    for repo in totals:
         print(trm.sep())
         print("Repository: "+repo)
-        print("Total: "+str(len(packages[repo])))
+        print("Total: "+str(totals[repo]))
         print(trm.sep())
 
-# For every repo specified, check the availability of packages given.
-verdict_dict = {}
-for repo in repo_list:
-    verdict_dict[repo] = {}
-    verdict_dict[repo]['ok'] = []
-    verdict_dict[repo]['miss'] = []
-    repo_path = os.path.join(package_cache, repo)
-    if args.table:
-        package_list = table_packages
-    else:
-        package_list = packages[repo]
-    if os.path.isdir(repo_path):
-        for package in package_list:
-            if package.startswith('lib'):
-                filename = package[0:4]
-            else:
-                filename = package[0]
-            if check(repo_path, filename, package):
-                verdict_dict[repo]['ok'].append(package)
-            else:
-                verdict_dict[repo]['miss'].append(package)
-        verdict_dict[repo]['ok'].sort()
-        verdict_dict[repo]['miss'].sort()
-    else:
-        sys.exit(repo_path + " is not a directory!")
-
 # Output either as a table or as a list
 color = None
 if args.table:
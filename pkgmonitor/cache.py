@@ -18,12 +18,83 @@
 
 import os
 import pathlib
+import fcntl
+import time
+
+class RepoLock:
+    """Advisory file lock on a single repository of the fetch or package cache
+
+    Writers hold an exclusive lock, readers a shared one. With wait=False the
+    lock is not acquired if another process holds it, check acquired afterwards.
+    """
+    def __init__(self, path, shared=False, wait=True):
+        self.path = path
+        self.shared = shared
+        self.wait = wait
+        self.acquired = False
+        self.attempted = False
+        self.wait_time = 0.0
+        self.lock_file = None
+
+    def acquire(self):
+        """Acquires the lock
+        Returns:
+            True, if the lock was acquired
+            False, if wait is False and the lock is held by another process
+        """
+        if self.shared:
+            flags = fcntl.LOCK_SH
+        else:
+            flags = fcntl.LOCK_EX
+        if not self.wait:
+            flags |= fcntl.LOCK_NB
+        self.attempted = True
+        if self.path is None:
+            self.acquired = True
+            return True
+        try:
+            self.lock_file = open(self.path, 'a')
+        except OSError:
+            if not self.shared:
+                raise
+            # Readers without write access can still share an existing lock file.
+            self.lock_file = open(self.path, 'r')
+        start = time.monotonic()
+        try:
+            fcntl.flock(self.lock_file, flags)
+        except BlockingIOError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+        finally:
+            self.wait_time = time.monotonic() - start
+        self.acquired = True
+        return True
+
+    def release(self):
+        """Releases the lock, if it was acquired
+        """
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.acquired = False
+
+    def __enter__(self):
+        if not self.attempted:
+            self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
 
 class Cache:
-    def __init__(self, fetch_dir, package_dir, verbose):
+    def __init__(self, fetch_dir, package_dir, verbose, lock_dir=None):
         self.fetch_dir = fetch_dir
         self.package_dir = package_dir
         self.verbose = verbose
+        self.lock_dir = lock_dir
+        self.lock_wait_time = 0.0
     
     def __getDir(self, directory):
         """Returns the directoy contents
@@ -65,14 +136,25 @@ class Cache:
         """
         head = self.getFetchHead()
         for repo in head:
-            content = self.__getDir(repo)
-            for f in content:
-                if self.verbose:
-                    print('Removing file: '+f)
-                os.remove(f)
+            self.delFetchRepo(repo)
+
+    def delFetchRepo(self, directory):
+        """Deletes a specific fetch repository
+        Args:
+            directory: Either an absolute file path or the name of the fetch repository
+        Returns:
+            Nothing
+        """
+        if not os.path.isabs(directory):
+            directory = os.path.join(self.fetch_dir, directory)
+        content = self.__getDir(directory)
+        for f in content:
             if self.verbose:
-                print('Removing dir: '+repo)   
-            os.rmdir(repo)
+                print('Removing file: '+f)
+            os.remove(f)
+        if self.verbose:
+            print('Removing dir: '+directory)   
+        os.rmdir(directory)
 
     def getPackagesHead(self):
         """Returns the file paths of the package cache
@@ -112,3 +194,89 @@ class Cache:
         else:
             if self.verbose:
                 print(directory+" does not exist. Nothing to delete.")
+
+    def getPackageNames(self, directory):
+        """Returns all package names in the package cache of a specific repository
+        Args:
+            directory: Either an absolute file path or the name of the package repository
+        Returns:
+            Set of package names
+        """
+        names = set()
+        for f in self.getPackagesContent(directory):
+            with open(f, 'r') as pkg_file:
+                for line in pkg_file:
+                    names.add(line.rstrip())
+        return names
+
+    def getPackagesFingerprint(self, directory):
+        """Returns a fingerprint of the package cache generation of a specific repository
+        The fingerprint changes whenever pkgmonitor-update.py rebuilds the package cache.
+        Args:
+            directory: Either an absolute file path or the name of the package repository
+        Returns:
+            Sorted list of [file name, size, modification time in ns] of the package cache files
+        """
+        fingerprint = []
+        for f in self.getPackagesContent(directory):
+            stat = os.stat(f)
+            fingerprint.append([os.path.basename(f), stat.st_size, stat.st_mtime_ns])
+        fingerprint.sort()
+        return fingerprint
+
+    def __lock(self, kind, repo, shared, wait):
+        """Acquires a lock on a repository
+        Args:
+            kind: Either "fetch" or "packages"
+            repo: Either an absolute file path or the name of the repository
+            shared: True for a reader lock, False for an exclusive writer lock
+            wait: True to block until the lock is available, False to give up immediately
+        Returns:
+            RepoLock, check its acquired attribute. Without a lock_dir, no locking takes place.
+            A shared lock falls back to no locking if lock_dir is not accessible.
+        """
+        name = repo[repo.rfind('/')+1:]
+        if self.lock_dir is None:
+            return RepoLock(None, shared, wait)
+        lock = RepoLock(os.path.join(self.lock_dir, kind+'-'+name+'.lock'), shared, wait)
+        try:
+            if not os.path.exists(self.lock_dir):
+                os.makedirs(self.lock_dir, exist_ok=True)
+            lock.acquire()
+        except OSError as e:
+            if not shared:
+                raise
+            # A reader without access to lock_dir reads unlocked instead of failing.
+            if self.verbose:
+                print('Reading '+kind+' cache of '+name+' unlocked: '+str(e))
+            lock = RepoLock(None, shared, wait)
+            lock.acquire()
+            return lock
+        self.lock_wait_time += lock.wait_time
+        if self.verbose:
+            if lock.acquired:
+                print('Locked '+kind+' cache of '+name+' after waiting {:.3f}s'.format(lock.wait_time))
+            else:
+                print('Skipping '+name+', its '+kind+' cache is locked by another process')
+        return lock
+
+    def lockFetch(self, repo, wait=True):
+        """Locks the fetch cache of a specific repository exclusively
+        Args:
+            repo: Either an absolute file path or the name of the fetch repository
+            wait: True to block until the lock is available, False to give up immediately
+        Returns:
+            RepoLock usable as context manager
+        """
+        return self.__lock('fetch', repo, False, wait)
+
+    def lockPackages(self, repo, shared=False, wait=True):
+        """Locks the package cache of a specific repository
+        Args:
+            repo: Either an absolute file path or the name of the package repository
+            shared: True when only reading the package cache
+            wait: True to block until the lock is available, False to give up immediately
+        Returns:
+            RepoLock usable as context manager
+        """
+        return self.__lock('packages', repo, shared, wait)
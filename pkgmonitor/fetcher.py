@@ -17,17 +17,38 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import yaml
-import subprocess
+import sys
+import time
+import urllib.request
+import http.client
+from pkgmonitor.mirror import MirrorHealth
 
 class Fetcher:
-    def __init__(self, name, repo, url, arch, verbose, cache):
+    """Downloads the package lists of a repository
+
+    url is either a single url template or a list of mirror url templates.
+    Mirrors are probed and ranked by their measured health, every file is
+    downloaded from the best mirror and fails over to the next one after
+    1 + retries failed attempts with exponential backoff. The file name in the fetch
+    cache is always derived from the first url template.
+    """
+    def __init__(self, name, repo, url, arch, verbose, cache, health=None, timeout=30, retries=3, backoff=1.0):
         self.cache = cache
         self.name = name
         self.repo = repo
-        self.url = url
+        if isinstance(url, list):
+            self.mirrors = url
+        else:
+            self.mirrors = [url]
+        self.url = self.mirrors[0]
         self.arch = arch
         self.verbose = verbose
+        self.health = health
+        if self.health is None:
+            self.health = MirrorHealth(verbose=verbose)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
         self.dir = os.path.join(self.cache, self.name)
         self.urls_to_fetch = []
         self.__create_cache()
@@ -37,14 +58,102 @@ class Fetcher:
         if not os.path.exists(self.dir):
             os.makedirs(self.dir)
 
+    def __expand(self, template, repo, arch):
+        return template.replace('{dist}', repo).replace('{arch}', arch)
+
     def __set_urls(self):
         for repo in self.repo:
             for arch in self.arch:
-                self.urls_to_fetch.append(self.url.replace('{dist}', repo).replace('{arch}', arch))
+                self.urls_to_fetch.append((repo, arch))
 
-    def get_packages(self):
-        for url in self.urls_to_fetch:
-            filename = url.replace('/', '_')
+    def __probe(self, mirror):
+        """Measures the latency of a mirror with a HEAD request for its first file
+        """
+        repo, arch = self.urls_to_fetch[0]
+        request = urllib.request.Request(self.__expand(mirror, repo, arch), method='HEAD')
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except (OSError, ValueError, http.client.HTTPException) as e:
             if self.verbose:
-                print("Fetching: "+url)
-            subprocess.run(['wget', url, '--quiet', '-O', os.path.join(self.dir, filename)])
+                print("Probe failed: "+mirror+" ("+str(e)+")")
+            self.health.record_failure(mirror)
+            return
+        latency = time.monotonic() - start
+        self.health.record_latency(mirror, latency)
+        if self.verbose:
+            print("Probe: "+mirror+" {:.3f}s".format(latency))
+
+    def __download(self, url, path):
+        """Downloads url to path, the existing file is only replaced by a complete download
+        Returns:
+            Tuple of (bytes downloaded, seconds needed after the response headers arrived)
+        """
+        part = path + '.part'
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response, open(part, 'wb') as f:
+                start = time.monotonic()
+                expected = response.headers.get('Content-Length')
+                size = 0
+                while True:
+                    data = response.read(65536)
+                    if not data:
+                        break
+                    f.write(data)
+                    size += len(data)
+                duration = time.monotonic() - start
+            if expected is not None and int(expected) != size:
+                raise OSError("incomplete download, got "+str(size)+" of "+expected+" bytes")
+            if size == 0:
+                raise OSError("empty download")
+            os.replace(part, path)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        return size, duration
+
+    def __fetch(self, repo, arch, mirrors):
+        """Fetches a single file, failing over between the ranked mirrors
+        Returns:
+            True, if the file was downloaded
+        """
+        filename = self.__expand(self.url, repo, arch).replace('/', '_')
+        path = os.path.join(self.dir, filename)
+        for mirror in mirrors:
+            url = self.__expand(mirror, repo, arch)
+            for attempt in range(self.retries + 1):
+                if attempt > 0:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                if self.verbose:
+                    print("Fetching: "+url)
+                try:
+                    size, duration = self.__download(url, path)
+                except (OSError, ValueError, http.client.HTTPException) as e:
+                    if self.verbose:
+                        print("Failed: "+url+" ("+str(e)+")")
+                    self.health.record_failure(mirror)
+                    continue
+                self.health.record_success(mirror, size, duration)
+                return True
+        return False
+
+    def get_packages(self):
+        """Downloads all package lists of the repository
+        Returns:
+            True, if every file was downloaded. Files that could not be fetched
+            from any mirror keep their previous content in the fetch cache.
+        """
+        if len(self.mirrors) > 1:
+            for mirror in self.mirrors:
+                self.__probe(mirror)
+        mirrors = self.health.rank(self.mirrors)
+        if self.verbose and len(mirrors) > 1:
+            print("Mirror order: "+", ".join(mirrors))
+        success = True
+        for repo, arch in self.urls_to_fetch:
+            if not self.__fetch(repo, arch, mirrors):
+                print("Could not fetch "+self.__expand(self.url, repo, arch)+" from any mirror", file=sys.stderr)
+                success = False
+        self.health.save()
+        return success
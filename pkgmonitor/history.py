@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+
+class History:
+    """Append-only snapshot history of the package cache
+
+    Every repository has a log file (REPO.log) containing one json record per
+    line. A record is either a full checkpoint of all package names or a delta
+    holding the names added and removed since the previous generation.
+    REPO.idx holds one "generation time offset" line per checkpoint, so a query
+    only has to replay the deltas following the nearest checkpoint.
+    A final line without a newline is a torn write of an interrupted updater, it is
+    ignored by readers and removed before the next record is appended.
+    """
+    def __init__(self, history_dir, checkpoint_interval=30, verbose=False):
+        self.history_dir = history_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.verbose = verbose
+        self.__create_cache()
+
+    def __create_cache(self):
+        if not os.path.exists(self.history_dir):
+            os.makedirs(self.history_dir)
+
+    def __log_file(self, repo):
+        return os.path.join(self.history_dir, repo + '.log')
+
+    def __index_file(self, repo):
+        return os.path.join(self.history_dir, repo + '.idx')
+
+    def __read_index(self, repo):
+        """Returns the checkpoint index of a repository
+        Returns:
+            List of (generation, time, offset) tuples in ascending order
+        """
+        index = []
+        if not os.path.exists(self.__index_file(repo)):
+            return index
+        with open(self.__index_file(repo), 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                fields = line.split()
+                if len(fields) == 3:
+                    index.append((int(fields[0]), int(fields[1]), int(fields[2])))
+        return index
+
+    def __replay(self, repo, timestamp=None):
+        """Reconstructs the package names of a repository
+        Args:
+            repo: name of the repository
+            timestamp: reconstruct the state at this unix time, None for the latest state
+        Returns:
+            Tuple of (set of package names, generation, generation of the last checkpoint).
+            The set is None if nothing was recorded up to timestamp.
+        """
+        names = None
+        generation = 0
+        checkpoint = 0
+        if not os.path.exists(self.__log_file(repo)):
+            return names, generation, checkpoint
+        offset = 0
+        for entry in self.__read_index(repo):
+            if timestamp is not None and entry[1] > timestamp:
+                break
+            offset = entry[2]
+        with open(self.__log_file(repo), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                record = json.loads(line.decode('utf-8'))
+                if timestamp is not None and record['time'] > timestamp:
+                    break
+                if record['type'] == 'checkpoint':
+                    names = set(record['names'])
+                    checkpoint = record['gen']
+                else:
+                    names.difference_update(record['del'])
+                    names.update(record['add'])
+                generation = record['gen']
+        return names, generation, checkpoint
+
+    def __repair(self, path):
+        """Truncates a torn final line, so the next append starts on a new line
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # Search backwards for the end of the last complete line
+            end = size - 1
+            while end > 0:
+                start = max(end - 65536, 0)
+                f.seek(start)
+                chunk = f.read(end - start)
+                pos = chunk.rfind(b'\n')
+                if pos != -1:
+                    end = start + pos + 1
+                    break
+                end = start
+            if self.verbose:
+                print("Removing torn record from: "+path)
+            f.truncate(end)
+
+    def __append(self, repo, record):
+        self.__repair(self.__log_file(repo))
+        self.__repair(self.__index_file(repo))
+        with open(self.__log_file(repo), 'ab') as f:
+            offset = f.tell()
+            f.write(json.dumps(record, separators=(',', ':'), sort_keys=True).encode('utf-8') + b'\n')
+        if record['type'] == 'checkpoint':
+            with open(self.__index_file(repo), 'a') as f:
+                f.write("%d %d %d\n" % (record['gen'], record['time'], offset))
+
+    def getRepos(self):
+        """Returns the names of all repositories with a recorded history
+        """
+        repos = []
+        for f in sorted(os.listdir(self.history_dir)):
+            if f.endswith('.log'):
+                repos.append(f[:-len('.log')])
+        return repos
+
+    def record(self, repo, names, timestamp=None):
+        """Records a new generation of a repository
+        The caller has to hold the exclusive packages lock of the repository.
+        Args:
+            repo: name of the repository
+            names: iterable of all package names currently in the repository
+            timestamp: unix time of the generation, defaults to now
+        Returns:
+            Nothing. Nothing is written if the package names did not change.
+        """
+        if timestamp is None:
+            timestamp = int(time.time())
+        names = set(names)
+        previous, generation, checkpoint = self.__replay(repo)
+        if previous is None or generation - checkpoint + 1 >= self.checkpoint_interval:
+            record = {'type': 'checkpoint', 'gen': generation + 1, 'time': timestamp,
+                      'names': sorted(names)}
+            if self.verbose:
+                print("History checkpoint: "+repo+" generation "+str(generation + 1))
+        else:
+            added = names - previous
+            removed = previous - names
+            if not added and not removed:
+                if self.verbose:
+                    print("History unchanged: "+repo)
+                return
+            record = {'type': 'delta', 'gen': generation + 1, 'time': timestamp,
+                      'add': sorted(added), 'del': sorted(removed)}
+            if self.verbose:
+                print("History delta: "+repo+" +"+str(len(added))+" -"+str(len(removed)))
+        self.__append(repo, record)
+
+    def getState(self, repo, timestamp=None):
+        """Returns the package names of a repository at a given time
+        Args:
+            repo: name of the repository
+            timestamp: unix time, None for the latest recorded state
+        Returns:
+            Set of package names, None if nothing was recorded up to timestamp
+        """
+        return self.__replay(repo, timestamp)[0]
+
+    def getEvents(self, repo, package):
+        """Returns every change of a package's availability in a repository
+        Args:
+            repo: name of the repository
+            package: name of the package
+        Returns:
+            List of (unix time, present) tuples, present is True when the package
+            was added and False when it was removed
+        """
+        events = []
+        present = False
+        if not os.path.exists(self.__log_file(repo)):
+            return events
+        with open(self.__log_file(repo), 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                # Skip decoding records that cannot change the package's state
+                if package.encode('utf-8') not in line:
+                    if not present or b'"type":"delta"' in line:
+                        continue
+                record = json.loads(line.decode('utf-8'))
+                if record['type'] == 'checkpoint':
+                    now_present = package in record['names']
+                elif package in record['add']:
+                    now_present = True
+                elif package in record['del']:
+                    now_present = False
+                else:
+                    now_present = present
+                if now_present != present:
+                    events.append((record['time'], now_present))
+                    present = now_present
+        return events
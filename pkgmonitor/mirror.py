@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+from pkgmonitor.cache import RepoLock
+
+class MirrorHealth:
+    """Measured latency, throughput and failures of mirrors, persisted between runs
+
+    Mirrors are identified by their url template. Latency and throughput are
+    exponentially weighted moving averages, failures counts consecutive failures
+    and is reset by the next successful download. A failing mirror is ranked
+    last for a cooldown that doubles with every consecutive failure.
+    Saving merges with the health file, so parallel updaters only replace the
+    mirrors they measured themselves.
+    """
+    def __init__(self, health_file=None, verbose=False):
+        self.health_file = health_file
+        self.verbose = verbose
+        self.WEIGHT = 0.3
+        self.EXPECTED_SIZE = 1048576
+        self.COOLDOWN = 600
+        self.MAX_COOLDOWN = 86400
+        self.mirrors = self.__load()
+        self.changed = set()
+
+    def __load(self):
+        if self.health_file is None or not os.path.exists(self.health_file):
+            return {}
+        try:
+            with open(self.health_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            if self.verbose:
+                print("Ignoring corrupt mirror health file: "+self.health_file)
+        return {}
+
+    def __get(self, mirror, changed=False):
+        if changed:
+            self.changed.add(mirror)
+        if mirror not in self.mirrors:
+            self.mirrors[mirror] = {'latency': None, 'throughput': None, 'failures': 0, 'last_failure': None}
+        return self.mirrors[mirror]
+
+    def __average(self, old, new):
+        if old is None:
+            return new
+        return (1 - self.WEIGHT) * old + self.WEIGHT * new
+
+    def save(self):
+        """Writes the health of the changed mirrors to the health file
+        The health file is re-read under a lock, mirrors saved by other processes
+        in the meantime are kept.
+        """
+        if self.health_file is None:
+            return
+        directory = os.path.dirname(self.health_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with RepoLock(self.health_file + '.lock'):
+            mirrors = self.__load()
+            for mirror in self.changed:
+                mirrors[mirror] = self.mirrors[mirror]
+            tmp_file = self.health_file + '.' + str(os.getpid())
+            with open(tmp_file, 'w') as f:
+                json.dump(mirrors, f, indent=2, sort_keys=True)
+            os.replace(tmp_file, self.health_file)
+        self.mirrors = mirrors
+        self.changed = set()
+
+    def record_latency(self, mirror, latency):
+        """Records the response time of a successful probe request in seconds
+        """
+        health = self.__get(mirror, True)
+        health['latency'] = self.__average(health['latency'], latency)
+
+    def record_success(self, mirror, size, duration):
+        """Records a successful download of size bytes in duration seconds
+        """
+        health = self.__get(mirror, True)
+        health['throughput'] = self.__average(health['throughput'], size / max(duration, 0.001))
+        health['failures'] = 0
+
+    def record_failure(self, mirror):
+        """Records a failed probe or download
+        """
+        health = self.__get(mirror, True)
+        health['failures'] += 1
+        health['last_failure'] = int(time.time())
+
+    def estimate(self, mirror, default_throughput=None):
+        """Estimates the time needed to download a file from a mirror
+        Args:
+            mirror: mirror url template
+            default_throughput: bytes per second assumed if the throughput was never measured
+        Returns:
+            Estimated seconds, None if the mirror was never measured
+        """
+        health = self.__get(mirror)
+        if health['latency'] is None:
+            return None
+        estimate = health['latency']
+        throughput = health['throughput'] or default_throughput
+        if throughput:
+            estimate += self.EXPECTED_SIZE / throughput
+        return estimate
+
+    def cooling_down(self, mirror):
+        """Returns True if the mirror failed recently
+        """
+        health = self.__get(mirror)
+        if health['failures'] == 0:
+            return False
+        cooldown = min(self.COOLDOWN * 2 ** (health['failures'] - 1), self.MAX_COOLDOWN)
+        return time.time() - health['last_failure'] < cooldown
+
+    def rank(self, mirrors):
+        """Orders mirrors from best to worst
+        Mirrors cooling down after a failure come last, the others are ordered by
+        their estimated download time. Unmeasured mirrors keep their configured
+        order behind measured ones.
+        Args:
+            mirrors: list of mirror url templates
+        Returns:
+            Sorted list of mirror url templates
+        """
+        measured = [self.__get(m)['throughput'] for m in mirrors if self.__get(m)['throughput']]
+        default_throughput = None
+        if measured:
+            default_throughput = sum(measured) / len(measured)
+        def key(mirror):
+            estimate = self.estimate(mirror, default_throughput)
+            return (self.cooling_down(mirror), estimate is None, estimate or 0, mirrors.index(mirror))
+        return sorted(mirrors, key=key)
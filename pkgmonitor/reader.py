@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from collections import OrderedDict
+
+class InputReader:
+    """Streams package names out of input files
+
+    Supported formats:
+        plain: one package name per line
+        dpkg-status: /var/lib/dpkg/status, only installed packages
+        dpkg-l: output of dpkg -l, only installed packages
+        packages: Packages manifest, every package
+    Every stage is a generator, so inputs are never loaded into memory as a whole.
+    """
+    FORMATS = ['plain', 'dpkg-status', 'dpkg-l', 'packages']
+
+    def __init__(self, input_format='plain', window=65536, batch_size=1024):
+        if input_format not in self.FORMATS:
+            raise ValueError("Unknown input format: "+input_format)
+        self.input_format = input_format
+        self.window = window
+        self.batch_size = batch_size
+        self.dpkg_l_state = re.compile('^[uirhp][nicuhfwt][r ]?$', re.IGNORECASE)
+
+    def __strip_arch(self, pkg):
+        if ':' in pkg:
+            return pkg[:pkg.find(':')]
+        return pkg
+
+    def __read_plain(self, stream):
+        for line in stream:
+            pkg = line.strip()
+            if pkg:
+                yield pkg
+
+    def __read_dpkg_status(self, stream):
+        pkg = None
+        status = None
+        for line in stream:
+            if line.startswith('Package:'):
+                pkg = line.split()[1]
+            elif line.startswith('Status:'):
+                status = line.split()[1:]
+            elif not line.strip():
+                if pkg is not None and (status is None or status[-1] == 'installed'):
+                    yield pkg
+                pkg = None
+                status = None
+        if pkg is not None and (status is None or status[-1] == 'installed'):
+            yield pkg
+
+    def __read_dpkg_l(self, stream):
+        for line in stream:
+            fields = line.split()
+            if len(fields) < 2 or not self.dpkg_l_state.match(fields[0]):
+                continue
+            if fields[0][1] == 'i':
+                yield self.__strip_arch(fields[1])
+
+    def __read_packages(self, stream):
+        for line in stream:
+            if line.startswith('Package:'):
+                yield line.split()[1]
+
+    def read(self, stream):
+        """Parses a stream according to the input format
+        Args:
+            stream: iterable of lines, e.g. an open file or sys.stdin
+        Returns:
+            Generator of package names
+        """
+        if self.input_format == 'dpkg-status':
+            return self.__read_dpkg_status(stream)
+        elif self.input_format == 'dpkg-l':
+            return self.__read_dpkg_l(stream)
+        elif self.input_format == 'packages':
+            return self.__read_packages(stream)
+        return self.__read_plain(stream)
+
+    def unique(self, names):
+        """Drops duplicate package names
+        Only the last window distinct names are remembered, so memory stays bounded.
+        A duplicate outside of the window is passed on and removed later by the caller.
+        Args:
+            names: iterable of package names
+        Returns:
+            Generator of package names
+        """
+        seen = OrderedDict()
+        for pkg in names:
+            if pkg in seen:
+                seen.move_to_end(pkg)
+                continue
+            seen[pkg] = None
+            if len(seen) > self.window:
+                seen.popitem(last=False)
+            yield pkg
+
+    def batches(self, names):
+        """Groups package names into lists of batch_size names
+        Args:
+            names: iterable of package names
+        Returns:
+            Generator of lists of package names
+        """
+        batch = []
+        for pkg in names:
+            batch.append(pkg)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
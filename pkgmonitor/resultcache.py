@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import hashlib
+import pathlib
+from pkgmonitor.cache import RepoLock
+
+class ResultCache:
+    """Size bounded on-disk cache of query results
+
+    Every result is stored as KEY.json, where KEY is the sha256 of everything the
+    result depends on. The modification time of an entry is its last use, the least
+    recently used entries are evicted once the cache exceeds max_size bytes.
+    Hit and miss counts of all runs are kept in the file stats, which is updated
+    under a lock, so concurrent queries do not lose counts.
+    """
+    def __init__(self, cache_dir, max_size, verbose=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.verbose = verbose
+        self.stats_file = os.path.join(self.cache_dir, 'stats')
+        self.__create_cache()
+
+    def __create_cache(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __entry(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def __write(self, path, data):
+        tmp_file = path + '.' + str(os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, path)
+
+    def __count(self, field):
+        try:
+            with RepoLock(self.stats_file + '.lock'):
+                stats = self.getStats()
+                stats[field] += 1
+                self.__write(self.stats_file, stats)
+        except OSError:
+            # A read-only cache can still answer queries, it just does not count them.
+            return None
+        return stats
+
+    def __print_count(self, message, stats):
+        if stats is not None:
+            message += " (hits: "+str(stats['hits'])+", misses: "+str(stats['misses'])+")"
+        print(message)
+
+    def getStats(self):
+        """Returns the hit and miss counts of all runs
+        Returns:
+            Dictionary with the keys hits and misses
+        """
+        stats = {'hits': 0, 'misses': 0}
+        try:
+            with open(self.stats_file, 'r') as f:
+                stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    def key(self, *parts):
+        """Builds a cache key
+        Sets of package names are hashed name by name in sorted order, so they are
+        not serialized as a whole.
+        Args:
+            parts: json serializable values or sets of package names the result depends on
+        Returns:
+            Hex digest identifying the result
+        """
+        sha256 = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, (set, frozenset)):
+                for name in sorted(part):
+                    sha256.update(name.encode('utf-8'))
+                    sha256.update(b'\n')
+            else:
+                sha256.update(json.dumps(part, sort_keys=True).encode('utf-8'))
+            sha256.update(b'\0')
+        return sha256.hexdigest()
+
+    def get(self, key):
+        """Returns a cached result and marks it as recently used
+        Returns:
+            The cached result, None on a miss
+        """
+        try:
+            with open(self.__entry(key), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            stats = self.__count('misses')
+            if self.verbose:
+                self.__print_count("Result cache miss", stats)
+            return None
+        try:
+            os.utime(self.__entry(key))
+        except OSError:
+            # A read-only cache can still answer queries, it just does not track usage.
+            pass
+        stats = self.__count('hits')
+        if self.verbose:
+            self.__print_count("Result cache hit", stats)
+        return entry['result']
+
+    def put(self, key, repos, result):
+        """Stores a result and evicts the least recently used entries if needed
+        Args:
+            key: cache key of the result
+            repos: names of the repositories the result depends on
+            result: json serializable result
+        """
+        self.__write(self.__entry(key), {'repos': repos, 'result': result})
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits into max_size
+        """
+        entries = []
+        total = 0
+        for f in pathlib.Path(self.cache_dir).glob('*.json'):
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, str(f)))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            if self.verbose:
+                print("Evicting result: "+path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, repo):
+        """Removes every result depending on a repository
+        Args:
+            repo: name of the repository
+        """
+        for f in pathlib.Path(self.cache_dir).glob('*.json'):
+            try:
+                with open(str(f), 'r') as entry_file:
+                    entry = json.load(entry_file)
+            except (OSError, ValueError):
+                continue
+            if repo in entry['repos']:
+                if self.verbose:
+                    print("Invalidating result: "+str(f))
+                try:
+                    os.remove(str(f))
+                except OSError:
+                    pass
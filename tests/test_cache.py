@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+import unittest
+from pkgmonitor.cache import Cache
+
+class CacheLockTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # A file in place of lock_dir makes it inaccessible, even when running as root
+        blocker = os.path.join(self.tmp.name, 'blocker')
+        open(blocker, 'w').close()
+        self.cache = Cache(self.tmp.name, self.tmp.name, False, os.path.join(blocker, 'lock'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reader_without_lock_dir(self):
+        with self.cache.lockPackages('buster', shared=True) as lock:
+            self.assertTrue(lock.acquired)
+
+    def test_writer_without_lock_dir(self):
+        with self.assertRaises(OSError):
+            self.cache.lockPackages('buster')
+
+class CacheLockConflictTest(unittest.TestCase):
+    # flock locks of two open file descriptions conflict, even within one process
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = Cache(self.tmp.name, self.tmp.name, False, os.path.join(self.tmp.name, 'lock'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_exclusive_conflict(self):
+        with self.cache.lockPackages('buster') as first:
+            self.assertTrue(first.acquired)
+            with self.cache.lockPackages('buster', wait=False) as second:
+                self.assertFalse(second.acquired)
+            # Other repositories and the fetch cache are locked independently
+            with self.cache.lockPackages('bullseye', wait=False) as other:
+                self.assertTrue(other.acquired)
+            with self.cache.lockFetch('buster', wait=False) as fetch:
+                self.assertTrue(fetch.acquired)
+        with self.cache.lockPackages('buster', wait=False) as third:
+            self.assertTrue(third.acquired)
+
+    def test_shared_blocks_writer(self):
+        with self.cache.lockPackages('buster', shared=True) as reader:
+            with self.cache.lockPackages('buster', shared=True, wait=False) as second_reader:
+                self.assertTrue(second_reader.acquired)
+            with self.cache.lockPackages('buster', wait=False) as writer:
+                self.assertFalse(writer.acquired)
+
+    def test_writer_waits_for_reader(self):
+        reader = self.cache.lockPackages('buster', shared=True)
+        timer = threading.Timer(0.2, reader.release)
+        timer.start()
+        try:
+            with self.cache.lockPackages('buster') as writer:
+                self.assertTrue(writer.acquired)
+                self.assertGreaterEqual(writer.wait_time, 0.1)
+        finally:
+            timer.join()
+
+if __name__ == '__main__':
+    unittest.main()
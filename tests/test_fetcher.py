@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import http.server
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from pkgmonitor.fetcher import Fetcher
+from pkgmonitor.mirror import MirrorHealth
+
+class ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class StandIn:
+    """Local mirror stand-in with an injected delay or failure
+
+    Modes:
+        ok: serves the file
+        slow: serves the file after a delay
+        fail: answers with HTTP 500
+        truncate: announces more bytes than it sends
+        chunked: breaks off a chunked body in the middle
+        badstatus: sends a garbage status line
+    """
+    DELAY = 0.3
+
+    def __init__(self, mode, log):
+        self.mode = mode
+        stand_in = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                stand_in.handle(self, False)
+
+            def do_GET(self):
+                log.append((stand_in.mode, self.path))
+                stand_in.handle(self, True)
+
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:'+str(self.server.server_address[1])+'/{dist}/{arch}/Packages.gz'
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, handler, send_body):
+        body = gzip.compress(("Package: "+self.mode+"\n\n").encode('utf-8'))
+        handler.close_connection = True
+        if self.mode == 'badstatus':
+            handler.wfile.write(b"garbage\r\n\r\n")
+            return
+        if self.mode == 'fail':
+            handler.send_response(500)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        if self.mode == 'slow':
+            time.sleep(self.DELAY)
+        handler.send_response(200)
+        if self.mode == 'chunked':
+            handler.send_header('Transfer-Encoding', 'chunked')
+            handler.end_headers()
+            if send_body:
+                handler.wfile.write(b"%x\r\n" % len(body) + body[:len(body) // 2])
+            return
+        if self.mode == 'truncate':
+            handler.send_header('Content-Length', str(len(body) + 10))
+        else:
+            handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if send_body:
+            handler.wfile.write(body)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log = []
+        self.stand_ins = {}
+        for mode in ['ok', 'slow', 'fail', 'truncate', 'chunked', 'badstatus']:
+            self.stand_ins[mode] = StandIn(mode, self.log)
+        self.health = MirrorHealth(os.path.join(self.tmp.name, 'mirrors.json'))
+
+    def tearDown(self):
+        for stand_in in self.stand_ins.values():
+            stand_in.stop()
+        self.tmp.cleanup()
+
+    def fetcher(self, modes):
+        mirrors = [self.stand_ins[mode].url for mode in modes]
+        return Fetcher('test', ['dist'], mirrors, ['arch'], False, self.tmp.name,
+                       self.health, timeout=5, retries=2, backoff=0.01)
+
+    def cached_file(self, fetcher):
+        return os.path.join(fetcher.dir, fetcher.url.replace('{dist}', 'dist').replace('{arch}', 'arch').replace('/', '_'))
+
+    def read_cached(self, fetcher):
+        with gzip.open(self.cached_file(fetcher), 'rt') as f:
+            return f.read()
+
+    def test_failover(self):
+        f = self.fetcher(['badstatus', 'fail', 'chunked', 'truncate', 'slow'])
+        self.assertTrue(f.get_packages())
+        self.assertEqual(self.read_cached(f), "Package: slow\n\n")
+        # The broken mirrors answering the probe are tried once plus retries times each, then the slow one
+        tried = [mode for mode, path in self.log]
+        self.assertEqual(sorted(tried[:6]), ['chunked'] * 3 + ['truncate'] * 3)
+        self.assertEqual(tried[6:], ['slow'])
+        self.assertEqual([p for p in os.listdir(f.dir) if p.endswith('.part')], [])
+
+    def test_keep_cached_file(self):
+        f = self.fetcher(['badstatus', 'fail', 'truncate', 'chunked'])
+        with open(self.cached_file(f), 'wb') as cached:
+            cached.write(b'previous')
+        self.assertFalse(f.get_packages())
+        with open(self.cached_file(f), 'rb') as cached:
+            self.assertEqual(cached.read(), b'previous')
+        self.assertEqual(os.listdir(f.dir), [os.path.basename(self.cached_file(f))])
+
+    def test_rank_after_failures(self):
+        truncate = self.stand_ins['truncate'].url
+        slow = self.stand_ins['slow'].url
+        self.health.record_latency(truncate, 0.001)
+        self.health.record_latency(slow, 0.3)
+        self.assertEqual(self.health.rank([slow, truncate]), [truncate, slow])
+        f = self.fetcher(['truncate', 'slow'])
+        self.assertTrue(f.get_packages())
+        self.assertEqual(self.health.rank([slow, truncate]), [slow, truncate])
+        # The ranking is persisted for the next run
+        health = MirrorHealth(self.health.health_file)
+        self.assertEqual(health.rank([truncate, slow]), [slow, truncate])
+
+class MirrorHealthTest(unittest.TestCase):
+    def test_parallel_save(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            health_file = os.path.join(tmp, 'mirrors.json')
+            first = MirrorHealth(health_file)
+            second = MirrorHealth(health_file)
+            first.record_latency('http://a/{dist}/{arch}', 0.1)
+            second.record_failure('http://b/{dist}/{arch}')
+            first.save()
+            second.save()
+            merged = MirrorHealth(health_file)
+            self.assertEqual(merged.estimate('http://a/{dist}/{arch}'), 0.1)
+            self.assertTrue(merged.cooling_down('http://b/{dist}/{arch}'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import unittest
+from pkgmonitor.history import History
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.history = History(self.tmp.name, checkpoint_interval=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def log_file(self, repo):
+        return os.path.join(self.tmp.name, repo + '.log')
+
+    def records(self, repo):
+        with open(self.log_file(repo), 'r') as f:
+            return [json.loads(line) for line in f]
+
+    def test_checkpoint_interval(self):
+        for generation in range(7):
+            self.history.record('buster', ['pkg' + str(generation)], 100 * (generation + 1))
+        types = [record['type'] for record in self.records('buster')]
+        self.assertEqual(types, ['checkpoint', 'delta', 'delta'] * 2 + ['checkpoint'])
+        self.assertEqual([record['gen'] for record in self.records('buster')], list(range(1, 8)))
+        with open(os.path.join(self.tmp.name, 'buster.idx'), 'r') as f:
+            self.assertEqual([int(line.split()[0]) for line in f], [1, 4, 7])
+
+    def test_unchanged(self):
+        self.history.record('buster', ['a'], 100)
+        self.history.record('buster', ['a'], 200)
+        self.assertEqual(len(self.records('buster')), 1)
+
+    def test_state_at(self):
+        states = [['a'], ['a', 'b'], ['b'], ['b', 'c'], ['c']]
+        for generation, names in enumerate(states):
+            self.history.record('buster', names, 100 * (generation + 1))
+        self.assertIsNone(self.history.getState('buster', 50))
+        self.assertIsNone(self.history.getState('bullseye'))
+        self.assertEqual(self.history.getState('buster', 100), {'a'})
+        self.assertEqual(self.history.getState('buster', 250), {'a', 'b'})
+        # Replayed from the second checkpoint
+        self.assertEqual(self.history.getState('buster', 400), {'b', 'c'})
+        self.assertEqual(self.history.getState('buster', 1000), {'c'})
+        self.assertEqual(self.history.getState('buster'), {'c'})
+
+    def test_events(self):
+        for generation, names in enumerate([['a'], ['a', 'b'], ['a'], ['a'], ['a', 'b']]):
+            self.history.record('buster', names, 100 * (generation + 1))
+        self.assertEqual(self.history.getEvents('buster', 'b'), [(200, True), (300, False), (500, True)])
+        self.assertEqual(self.history.getEvents('buster', 'a'), [(100, True)])
+        self.assertEqual(self.history.getEvents('buster', 'c'), [])
+        self.assertEqual(self.history.getRepos(), ['buster'])
+
+    def test_torn_record(self):
+        self.history.record('buster', ['a', 'b'], 100)
+        self.history.record('buster', ['a'], 200)
+        with open(self.log_file('buster'), 'ab') as f:
+            f.write(b'{"add":["c"],"del"')
+        self.assertEqual(self.history.getState('buster'), {'a'})
+        self.assertEqual(self.history.getEvents('buster', 'b'), [(100, True), (200, False)])
+        self.history.record('buster', ['a', 'c'], 300)
+        self.assertEqual(self.history.getState('buster'), {'a', 'c'})
+        self.assertEqual(self.history.getState('buster', 250), {'a'})
+        with open(self.log_file('buster'), 'rb') as f:
+            self.assertEqual(len(f.read().splitlines()), 3)
+
+if __name__ == '__main__':
+    unittest.main()
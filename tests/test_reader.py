@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import unittest
+from pkgmonitor.reader import InputReader
+
+DPKG_STATUS = """Package: bash
+Status: install ok installed
+Version: 5.0-4
+
+Package: oldpkg
+Status: deinstall ok config-files
+
+Package: halfpkg
+Status: install ok half-installed
+
+Package: nostatus
+Version: 1.0
+
+Package: last
+Status: install ok installed"""
+
+DPKG_L = """Desired=Unknown/Install/Remove/Purge/Hold
+| Status=Not/Inst/Conf-files/Unpacked/halF-conf/Half-inst/trig-aWait/Trig-pend
+|/ Err?=(none)/Reinst-required (Status,Err: uppercase=bad)
+||/ Name           Version      Architecture Description
++++-==============-============-============-=================================
+ii  bash           5.0-4        amd64        GNU Bourne Again SHell
+rc  oldpkg         1.0          amd64        removed package
+iU  unpacked       1.0          amd64        unpacked package
+hi  libc6:amd64    2.28-10      amd64        GNU C Library
+iiR broken:i386    1.0          i386         reinstall required
+"""
+
+class InputReaderTest(unittest.TestCase):
+    def read(self, input_format, text):
+        return list(InputReader(input_format).read(io.StringIO(text)))
+
+    def test_plain(self):
+        self.assertEqual(self.read('plain', "bash\n\n  vim \n"), ['bash', 'vim'])
+
+    def test_dpkg_status(self):
+        self.assertEqual(self.read('dpkg-status', DPKG_STATUS), ['bash', 'nostatus', 'last'])
+
+    def test_dpkg_l(self):
+        self.assertEqual(self.read('dpkg-l', DPKG_L), ['bash', 'libc6', 'broken'])
+
+    def test_packages(self):
+        self.assertEqual(self.read('packages', "Package: bash\nVersion: 5.0\n\nPackage: vim\n"), ['bash', 'vim'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            InputReader('rpm')
+
+    def test_unique(self):
+        reader = InputReader(window=2)
+        # A duplicate moves a name to the end of the window, names pushed out of it are passed on again
+        names = ['a', 'b', 'a', 'b', 'c', 'b', 'd', 'a', 'b']
+        self.assertEqual(list(reader.unique(names)), ['a', 'b', 'c', 'd', 'a', 'b'])
+
+    def test_batches(self):
+        reader = InputReader(batch_size=2)
+        self.assertEqual(list(reader.batches(['a', 'b', 'c', 'd', 'e'])), [['a', 'b'], ['c', 'd'], ['e']])
+        self.assertEqual(list(reader.batches([])), [])
+
+if __name__ == '__main__':
+    unittest.main()
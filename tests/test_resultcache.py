@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# Copyright (C) 2019 Philipp Fromme
+#
+# This file is part of Pkgmonitor, a tool to locally cache and search through deb repositories.
+#
+# Pkgmonitor is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Pkgmonitor is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import multiprocessing
+import os
+import tempfile
+import unittest
+from pkgmonitor.resultcache import ResultCache
+
+def count_misses(cache_dir):
+    result_cache = ResultCache(cache_dir, 1048576)
+    for i in range(20):
+        result_cache.get(result_cache.key('missing', i))
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.result_cache = ResultCache(self.tmp.name, 1048576)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def entry(self, key):
+        return os.path.join(self.tmp.name, key + '.json')
+
+    def test_get_put(self):
+        key = self.result_cache.key('fingerprint', {'buster'})
+        self.assertIsNone(self.result_cache.get(key))
+        self.result_cache.put(key, ['buster'], {'totals': {'buster': 1}})
+        self.assertEqual(self.result_cache.get(key), {'totals': {'buster': 1}})
+        self.assertEqual(self.result_cache.getStats(), {'hits': 1, 'misses': 1})
+
+    def test_key(self):
+        key = self.result_cache.key([['b', 10, 1]], ['buster'], False, {'bash', 'vim'})
+        self.assertEqual(key, self.result_cache.key([['b', 10, 1]], ['buster'], False, {'vim', 'bash'}))
+        # A rebuilt shard changes the fingerprint of the package cache
+        self.assertNotEqual(key, self.result_cache.key([['b', 10, 2]], ['buster'], False, {'bash', 'vim'}))
+        self.assertNotEqual(key, self.result_cache.key([['b', 10, 1]], ['buster'], False, {'bash'}))
+        self.assertNotEqual(key, self.result_cache.key([['b', 10, 1]], ['buster'], True, {'bash', 'vim'}))
+
+    def test_evict(self):
+        keys = [self.result_cache.key(i) for i in range(3)]
+        for i, key in enumerate(keys):
+            self.result_cache.put(key, ['buster'], 'x' * 100)
+            os.utime(self.entry(key), (1000 + i, 1000 + i))
+        # Using the oldest entry makes the second one the least recently used
+        self.assertIsNotNone(self.result_cache.get(keys[0]))
+        self.result_cache.max_size = os.path.getsize(self.entry(keys[0])) * 2
+        self.result_cache.evict()
+        self.assertTrue(os.path.exists(self.entry(keys[0])))
+        self.assertFalse(os.path.exists(self.entry(keys[1])))
+        self.assertTrue(os.path.exists(self.entry(keys[2])))
+
+    def test_invalidate(self):
+        buster = self.result_cache.key('buster')
+        both = self.result_cache.key('both')
+        bullseye = self.result_cache.key('bullseye')
+        self.result_cache.put(buster, ['buster'], 1)
+        self.result_cache.put(both, ['buster', 'bullseye'], 2)
+        self.result_cache.put(bullseye, ['bullseye'], 3)
+        self.result_cache.invalidate('buster')
+        self.assertIsNone(self.result_cache.get(buster))
+        self.assertIsNone(self.result_cache.get(both))
+        self.assertEqual(self.result_cache.get(bullseye), 3)
+
+    def test_parallel_count(self):
+        processes = [multiprocessing.Process(target=count_misses, args=(self.tmp.name,)) for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(self.result_cache.getStats(), {'hits': 0, 'misses': 80})
+
+if __name__ == '__main__':
+    unittest.main()